@@ -1,5 +1,4 @@
 from resources import linkedin, summary, facts, style, projects
-from datetime import datetime
 
 
 full_name = facts["full_name"]
@@ -32,9 +31,6 @@ Here are some notes from {name} about their communications style:
 Here are some projects {name} has worked on:
 {projects}
 
-For reference, here is the current date and time:
-{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
 ## Your task
 
 You are to engage in conversation with the user, presenting yourself as {name} and answering questions about {name} as if you are {name}.
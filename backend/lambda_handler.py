@@ -1,11 +1,83 @@
 import asyncio
+import base64
+import sys
+import msgspec
+import orjson
+from fastapi import HTTPException
 from mangum import Mangum
-from server import app
+from server import app, chat_request_decoder, complete_chat, sse, warm_up_bedrock
 
-# FIX for Python 3.12+
-try:
-    asyncio.get_event_loop()
-except RuntimeError:
-    asyncio.set_event_loop(asyncio.new_event_loop())
+# Mangum needs a current event loop (Python 3.12+ no longer creates one implicitly).
+# Use uvloop where available; it isn't supported on Windows.
+if sys.platform != "win32":
+    import uvloop
 
-handler = Mangum(app)
+    loop = uvloop.new_event_loop()
+else:
+    loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+# Open the Bedrock connections during the init phase, so the first invocation
+# doesn't pay for the TLS handshakes
+loop.run_until_complete(warm_up_bedrock())
+
+# The warm-up already ran above and saves are written inline on Lambda, so skip
+# running the lifespan around every invocation
+asgi_handler = Mangum(app, lifespan="off")
+
+# Chat routes are dispatched straight from the API Gateway event, skipping the
+# ASGI scope, FastAPI routing and Mangum's response adapter
+CHAT_PATHS = ("/chat", "/chat/complete")
+
+
+def lambda_response(status_code: int, content_type: str, body: bytes) -> dict:
+    """Build an API Gateway HTTP API response"""
+    return {
+        "statusCode": status_code,
+        "headers": {"content-type": content_type},
+        "body": body.decode(),
+        "isBase64Encoded": False,
+    }
+
+
+def chat_handler(event) -> dict:
+    """Answer a chat request without going through the ASGI app"""
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+
+    try:
+        request = chat_request_decoder.decode(body)
+        # Run on the module's loop rather than asyncio.run, which would close it
+        # and drop the pooled Bedrock connections between invocations
+        reply = loop.run_until_complete(complete_chat(request))
+    except msgspec.DecodeError as e:
+        return lambda_response(422, "application/json", orjson.dumps({"detail": str(e)}))
+    except HTTPException as e:
+        return lambda_response(e.status_code, "application/json", orjson.dumps({"detail": e.detail}))
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        return lambda_response(500, "application/json", orjson.dumps({"detail": str(e)}))
+
+    if event["rawPath"] == "/chat/complete":
+        return lambda_response(200, "application/json", msgspec.json.encode(reply))
+
+    # API Gateway buffers the whole body anyway, so /chat sends the reply as a
+    # single delta in the same event sequence the streaming endpoint uses
+    events = (
+        sse("session", {"session_id": reply.session_id})
+        + sse("delta", {"text": reply.response})
+        + sse("done", {})
+    )
+    return lambda_response(200, "text/event-stream", events)
+
+
+def handler(event, context):
+    """Lambda entry point: chat routes directly, everything else through Mangum.
+
+    Expects API Gateway HTTP API events in payload format 2.0 (see terraform/main.tf).
+    """
+    method = event.get("requestContext", {}).get("http", {}).get("method")
+    if method == "POST" and event.get("rawPath") in CHAT_PATHS:
+        return chat_handler(event)
+    return asgi_handler(event, context)
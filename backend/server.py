@@ -1,30 +1,57 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
 import os
+import asyncio
 from dotenv import load_dotenv
-from typing import Optional, List, Dict
-import json
+from typing import Optional, List, Dict, Set, Tuple, AsyncIterator, Awaitable, Callable, TypeVar
 import uuid
-from datetime import datetime
-import boto3
-from botocore.exceptions import ClientError
-from context import prompt
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from compression import zstd
+import hashlib
+import itertools
+import httpx
+import msgspec
+import orjson
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# Running inside AWS Lambda (set by the Lambda runtime)
+IS_LAMBDA = bool(os.getenv("AWS_LAMBDA_FUNCTION_NAME"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Lambda runs Mangum with the lifespan off and warms up at import instead
+    # (see lambda_handler.py)
+    await warm_up_bedrock()
+    yield
+    # Let background saves finish so the last turns aren't lost on reload or exit
+    if _PENDING_SAVES:
+        await asyncio.wait(list(_PENDING_SAVES.values()))
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
+# On Lambda, API Gateway answers preflights and sets the CORS headers itself
+# (see cors_configuration in terraform/main.tf), so the middleware is only
+# needed when running the server directly
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=False,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["*"],
-)
+if not IS_LAMBDA:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=False,
+        allow_methods=["GET", "POST", "OPTIONS"],
+        allow_headers=["*"],
+    )
 
 # Bedrock model selection
 # Available models:
@@ -36,15 +63,32 @@ BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "us.amazon.nova-lite-v1:0")
 
 # Cross-region inference configuration
 # Multiple regions for failover when throttled
-BEDROCK_REGIONS = os.getenv("BEDROCK_REGIONS", "us-west-2,us-east-1,us-east-2").split(",")
+BEDROCK_REGIONS = tuple(os.getenv("BEDROCK_REGIONS", "us-west-2,us-east-1,us-east-2").split(","))
+
+# Each request starts from the next region in turn, spreading load across regions.
+# next() on itertools.count is atomic, so concurrent requests never share state.
+region_counter = itertools.count()
+
+# Number of regions to call concurrently; the first successful answer wins. Off by
+# default: Bedrock still runs (and bills) a losing call after the client cancels it,
+# so racing doubles token spend and quota use. With 1, regions are tried in turn.
+BEDROCK_FANOUT = max(1, int(os.getenv("BEDROCK_FANOUT", "1")))
+
+# Bedrock is called over a shared async HTTP client with SigV4-signed requests,
+# so a slow model response doesn't block the event loop for other chats.
+# HTTP/2 lets concurrent calls to the same region share one TLS connection.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
 
-# Initialize Bedrock clients for all configured regions
-bedrock_clients = {
-    region: boto3.client(service_name="bedrock-runtime", region_name=region)
-    for region in BEDROCK_REGIONS
-}
+# Replies to identical requests (same system prompt, history window and message) are
+# reused for REPLY_CACHE_TTL seconds, so retries and refreshes don't hit Bedrock again
+REPLY_CACHE_TTL = int(os.getenv("REPLY_CACHE_TTL", "60"))
+reply_cache: TTLCache = TTLCache(maxsize=10_000, ttl=REPLY_CACHE_TTL)
 
-# Track current region index for round-robin/failover
+# Region that served the most recent response (reported by /health)
 current_region_index = 0
 
 # Memory storage configuration
@@ -52,156 +96,670 @@ USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
 S3_BUCKET = os.getenv("S3_BUCKET", "")
 MEMORY_DIR = os.getenv("MEMORY_DIR", "../memory")
 
-# Initialize S3 client if needed
-if USE_S3:
-    s3_client = boto3.client("s3")
+# Hot conversations kept in memory, least recently used first:
+# session_id -> (messages, S3 ETag, the same messages already wrapped in Bedrock format)
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1024"))
+_CONV_CACHE: "OrderedDict[str, Tuple[List[Dict], Optional[str], List[Dict]]]" = OrderedDict()
+
+# In-flight background saves, one per session, so writes land in order
+_PENDING_SAVES: Dict[str, asyncio.Task] = {}
+
+# Sessions whose last background save failed; their next save rewrites the log whole
+# so the turns that never reached disk aren't left as a hole
+_FAILED_SAVES: Set[str] = set()
+
+
+# The system prompt is built once per container and reused for every request; the
+# current time is sent with each user message instead (see build_converse_payload)
+# (context pulls in the profile data, so it's imported on first use rather than at startup)
+@lru_cache(maxsize=None)
+def system_blocks() -> List[Dict]:
+    """Bedrock system content blocks holding the system prompt"""
+    from context import prompt
+
+    return [{"text": prompt()}]
+
+
+# Conversation history sent to Bedrock: at least the last 10 exchanges. The window
+# start only advances in steps of HISTORY_WINDOW_STEP messages (kept even so it always
+# lands on a user turn), so consecutive turns share an identical prompt prefix that
+# Bedrock's prompt caching can reuse.
+HISTORY_WINDOW = 20
+HISTORY_WINDOW_STEP = 10
+
+# Long-lived sessions are compacted: once history passes HISTORY_COMPACT_AT messages, or
+# the messages before the last HISTORY_KEEP reach roughly HISTORY_TOKEN_BUDGET tokens,
+# everything but the last HISTORY_KEEP messages is summarized by the model into a single
+# message at the head of the conversation
+HISTORY_COMPACT_AT = 40
+HISTORY_KEEP = 20
+HISTORY_TOKEN_BUDGET = 8000
+COMPACT_INSTRUCTION = (
+    "Summarize our conversation so far in 200 words or fewer. Keep any facts the user "
+    "shared about themselves and any open questions. Reply with the summary only."
+)
+
+
+# boto3/botocore are imported on first use to keep them off the Lambda cold-start path
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """S3 client, created on first use and kept for the life of the container"""
+    import boto3
+
+    return boto3.client("s3")
+
+
+_aws_credentials = None
+
+
+def get_aws_credentials():
+    """AWS credentials for signing Bedrock requests, resolved on first use.
+
+    Only a successful lookup is kept, so credentials that show up later (e.g. after
+    aws sso login on a running dev server) are picked up by the next request.
+    """
+    global _aws_credentials
+    if _aws_credentials is None:
+        import botocore.session
+        from botocore.exceptions import NoCredentialsError
+
+        credentials = botocore.session.get_session().get_credentials()
+        if credentials is None:
+            raise NoCredentialsError()
+        _aws_credentials = credentials
+    return _aws_credentials
+
+
+def aws_error_code(e: Exception) -> Optional[str]:
+    """Error code of a botocore ClientError, or None for any other exception"""
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
 
 
 # Request/Response models
-class ChatRequest(BaseModel):
+# The chat endpoints decode and encode these with msgspec directly, skipping
+# FastAPI's pydantic validation on the hot path
+class ChatRequest(msgspec.Struct):
     message: str
     session_id: Optional[str] = None
 
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct):
     response: str
     session_id: str
 
 
-class Message(BaseModel):
-    role: str
-    content: str
-    timestamp: str
+chat_request_decoder = msgspec.json.Decoder(ChatRequest)
 
 
 # Memory management functions
+def utc_timestamp() -> str:
+    """Current UTC time to the second, e.g. 2025-01-31T12:00:00Z"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
 def get_memory_path(session_id: str) -> str:
     return f"{session_id}.json"
 
 
-def load_conversation(session_id: str) -> List[Dict]:
-    """Load conversation history from storage"""
+def get_s3_key(session_id: str) -> str:
+    """S3 object holding the zstd-compressed conversation"""
+    return f"{session_id}.json.zst"
+
+
+def get_log_path(session_id: str) -> str:
+    """Local append-only conversation log, one JSON message per line"""
+    return os.path.join(MEMORY_DIR, f"{session_id}.jsonl")
+
+
+def rewrite_log(session_id: str, messages: List[Dict]):
+    """Replace the local log with the given messages in one atomic write"""
+    log_path = get_log_path(session_id)
+    tmp_path = f"{log_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(orjson.dumps(m, option=orjson.OPT_APPEND_NEWLINE) for m in messages))
+    os.replace(tmp_path, log_path)
+
+    # Conversations saved before the switch to logs are migrated on first write
+    legacy_path = os.path.join(MEMORY_DIR, get_memory_path(session_id))
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def read_conversation(session_id: str, etag: Optional[str] = None) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Read conversation history from storage (blocking).
+
+    Returns (messages, etag). For S3, messages is None when the stored object still
+    matches the given etag, i.e. the caller's cached copy is current.
+    """
     if USE_S3:
+        conditions = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = get_s3_client().get_object(
+                Bucket=S3_BUCKET, Key=get_s3_key(session_id), **conditions
+            )
+            return orjson.loads(zstd.decompress(response["Body"].read())), response["ETag"]
+        except Exception as e:
+            if aws_error_code(e) == "304":
+                return None, etag
+            if aws_error_code(e) != "NoSuchKey":
+                raise
+
+        # Conversations saved uncompressed, before the switch to zstd
         try:
-            response = s3_client.get_object(Bucket=S3_BUCKET, Key=get_memory_path(session_id))
-            return json.loads(response["Body"].read().decode("utf-8"))
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                return []
+            response = get_s3_client().get_object(Bucket=S3_BUCKET, Key=get_memory_path(session_id))
+            return orjson.loads(response["Body"].read()), None
+        except Exception as e:
+            if aws_error_code(e) == "NoSuchKey":
+                return [], None
             raise
     else:
         # Local file storage
+        log_path = get_log_path(session_id)
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                data = f.read()
+            # An append cut short (e.g. by a crash) leaves a partial last line; drop it so
+            # the log still loads and later appends start on a fresh line
+            complete, newline, _ = data.rpartition(b"\n")
+            keep = len(complete) + len(newline)
+            messages = [orjson.loads(line) for line in complete.split(b"\n") if line]
+            if messages and messages[-1]["role"] == "user":
+                # A turn's user and assistant lines go out in one write, so a user line
+                # without its reply is part of the same cut-short append. Bedrock rejects
+                # two user messages in a row, so drop it too
+                messages.pop()
+                keep = complete.rfind(b"\n") + 1
+            if keep < len(data):
+                print(f"Dropping an incomplete turn from conversation log {session_id}")
+                with open(log_path, "rb+") as f:
+                    f.truncate(keep)
+            return messages, None
+
+        # Conversations saved before the switch to logs
         file_path = os.path.join(MEMORY_DIR, get_memory_path(session_id))
         if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return json.load(f)
-        return []
+            with open(file_path, "rb") as f:
+                return orjson.loads(f.read()), None
+        return [], None
 
 
-def save_conversation(session_id: str, messages: List[Dict]):
-    """Save conversation history to storage"""
+def write_conversation(
+    session_id: str, messages: List[Dict], new_messages: Optional[List[Dict]] = None
+) -> Optional[str]:
+    """Write conversation history to storage (blocking). Returns the S3 ETag, if any.
+
+    S3 objects are rewritten whole. Local logs only have new_messages appended, or are
+    rewritten whole when new_messages is None (e.g. after compaction).
+    """
     if USE_S3:
-        s3_client.put_object(
+        response = get_s3_client().put_object(
             Bucket=S3_BUCKET,
-            Key=get_memory_path(session_id),
-            Body=json.dumps(messages, indent=2),
+            Key=get_s3_key(session_id),
+            Body=zstd.compress(orjson.dumps(messages), level=3),
             ContentType="application/json",
+            ContentEncoding="zstd",
         )
+        return response["ETag"]
     else:
         # Local file storage
         os.makedirs(MEMORY_DIR, exist_ok=True)
-        file_path = os.path.join(MEMORY_DIR, get_memory_path(session_id))
-        with open(file_path, "w") as f:
-            json.dump(messages, f, indent=2)
+        log_path = get_log_path(session_id)
+        if new_messages is not None and os.path.exists(log_path):
+            with open(log_path, "ab") as f:
+                f.write(b"".join(orjson.dumps(m, option=orjson.OPT_APPEND_NEWLINE) for m in new_messages))
+        else:
+            rewrite_log(session_id, messages)
+        return None
 
 
-def call_bedrock(conversation: List[Dict], user_message: str) -> str:
-    """Call AWS Bedrock with conversation history and cross-region failover"""
-    global current_region_index
+def to_bedrock_message(msg: Dict) -> Dict:
+    """Bedrock Converse form of a stored message; only role and text are sent"""
+    return {"role": msg["role"], "content": [{"text": msg["content"]}]}
+
+
+def bedrock_history(messages: List[Dict]) -> List[Dict]:
+    """Stored messages in Bedrock format, leaving out any compacted summary"""
+    return [to_bedrock_message(m) for m in messages if not m.get("compacted")]
+
+
+def cache_conversation(session_id: str, messages: List[Dict], etag: Optional[str]):
+    """Store a conversation in the in-memory LRU cache"""
+    cached = _CONV_CACHE.get(session_id)
+    if cached is not None and cached[0] is messages:
+        history = cached[2]
+    else:
+        history = bedrock_history(messages)
+    _CONV_CACHE[session_id] = (messages, etag, history)
+    _CONV_CACHE.move_to_end(session_id)
+    while len(_CONV_CACHE) > CONVERSATION_CACHE_SIZE:
+        _CONV_CACHE.popitem(last=False)
+
+
+async def load_conversation(session_id: str) -> List[Dict]:
+    """Load conversation history, serving hot sessions from memory"""
+    # Let any in-flight save for this session land first
+    pending = _PENDING_SAVES.get(session_id)
+    if pending is not None:
+        await asyncio.wait([pending])
+
+    cached = _CONV_CACHE.get(session_id)
+    if cached is not None and not USE_S3:
+        # Local storage has a single writer (this process), so the cache is authoritative
+        _CONV_CACHE.move_to_end(session_id)
+        return cached[0]
+
+    # Other Lambda containers may have written to S3, so revalidate against the ETag
+    messages, etag = await asyncio.to_thread(
+        read_conversation, session_id, cached[1] if cached else None
+    )
+    if messages is None:
+        messages = cached[0]
+    cache_conversation(session_id, messages, etag)
+    return messages
+
+
+def needs_compaction(messages: List[Dict]) -> bool:
+    """Whether the history has outgrown HISTORY_COMPACT_AT or HISTORY_TOKEN_BUDGET"""
+    if len(messages) - HISTORY_KEEP < 2:
+        return False
+    # Only the part compaction would summarize counts toward the budget; the kept tail
+    # can't be shrunk, so counting it would re-compact on every save once it is long.
+    # Rough estimate of ~4 characters per token
+    tokens = sum(len(m["content"]) for m in messages[:-HISTORY_KEEP]) // 4
+    return len(messages) > HISTORY_COMPACT_AT or tokens > HISTORY_TOKEN_BUDGET
+
+
+async def compact_conversation(messages: List[Dict]) -> List[Dict]:
+    """Replace all but the last HISTORY_KEEP messages with a model-written summary"""
+    summary = await call_bedrock(messages[:-HISTORY_KEEP], COMPACT_INSTRUCTION)
+    return [
+        {
+            "role": "assistant",
+            "content": summary,
+            "compacted": True,
+            "timestamp": utc_timestamp(),
+        }
+    ] + messages[-HISTORY_KEEP:]
+
+
+async def persist_conversation(
+    session_id: str, messages: List[Dict], new_messages: List[Dict], previous: Optional[asyncio.Task]
+):
+    """Write a snapshot of the conversation, after any earlier write for the same session"""
+    if previous is not None:
+        await asyncio.wait([previous])
+
+    compacted = None
+    if needs_compaction(messages):
+        try:
+            compacted = await compact_conversation(messages)
+        except Exception as e:
+            # Keep the full history; compaction is retried on the next save
+            print(f"Error compacting conversation {session_id}: {e}")
+
+    if compacted is not None:
+        etag = await asyncio.to_thread(write_conversation, session_id, compacted)
+    elif session_id in _FAILED_SAVES:
+        etag = await asyncio.to_thread(write_conversation, session_id, messages)
+    else:
+        etag = await asyncio.to_thread(write_conversation, session_id, messages, new_messages)
+    _FAILED_SAVES.discard(session_id)
+
+    cached = _CONV_CACHE.get(session_id)
+    if cached is not None:
+        live, _, history = cached
+        if compacted is not None:
+            # Swap the summarized prefix in place; turns appended since the snapshot stay
+            summarized = len(messages) - HISTORY_KEEP
+            if live[:summarized] == messages[:summarized]:
+                live[:summarized] = compacted[:1]
+                history = bedrock_history(live)
+        _CONV_CACHE[session_id] = (live, etag, history)
+
+
+def _save_done(session_id: str, task: asyncio.Task):
+    if _PENDING_SAVES.get(session_id) is task:
+        del _PENDING_SAVES[session_id]
+    if task.cancelled():
+        _FAILED_SAVES.add(session_id)
+    elif task.exception() is not None:
+        print(f"Error saving conversation {session_id}: {task.exception()}")
+        _FAILED_SAVES.add(session_id)
+
+
+async def save_conversation(session_id: str, messages: List[Dict], new_messages: List[Dict]):
+    """Save conversation history to memory and storage; new_messages are the ones just appended"""
+    cached = _CONV_CACHE.get(session_id)
+    if cached is not None and cached[0] is messages:
+        # Keep the Bedrock-formatted copy in step; only the new turn gets wrapped
+        cached[2].extend(to_bedrock_message(m) for m in new_messages)
+    cache_conversation(session_id, messages, cached[1] if cached else None)
+
+    if IS_LAMBDA:
+        # Lambda freezes the sandbox once the response is returned, so write before replying
+        try:
+            await persist_conversation(session_id, list(messages), new_messages, None)
+        except Exception:
+            # Don't let the cache serve history that never reached storage
+            _CONV_CACHE.pop(session_id, None)
+            raise
+        return
+
+    # Otherwise write in the background so the response isn't held up by storage
+    task = asyncio.create_task(
+        persist_conversation(session_id, list(messages), new_messages, _PENDING_SAVES.get(session_id))
+    )
+    _PENDING_SAVES[session_id] = task
+    task.add_done_callback(partial(_save_done, session_id))
+
+
+def aws_client_error(code: str, message: str, operation: str) -> Exception:
+    """Build a botocore ClientError, so Bedrock errors look the same as boto3's"""
+    from botocore.exceptions import ClientError
+
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+async def bedrock_error(response: httpx.Response, operation: str) -> Exception:
+    """Turn a failed Bedrock HTTP response into a botocore-style ClientError"""
+    await response.aread()
+    # e.g. "ThrottlingException:http://internal.amazon.com/coral/..."
+    code = response.headers.get("x-amzn-ErrorType", "").split(":")[0] or str(response.status_code)
+    try:
+        message = response.json().get("message", response.text)
+    except ValueError:
+        message = response.text
+    return aws_client_error(code, message, operation)
+
+
+def bedrock_endpoint(region: str) -> str:
+    return f"https://bedrock-runtime.{region}.amazonaws.com"
+
+
+async def warm_up_bedrock():
+    """Open connections to every Bedrock region so the first chat skips the TLS handshake"""
+
+    async def touch(region: str):
+        try:
+            await http_client.head(bedrock_endpoint(region))
+        except httpx.HTTPError as e:
+            print(f"Bedrock warm-up failed for region {region}: {e}")
+
+    await asyncio.gather(*(touch(region) for region in BEDROCK_REGIONS))
+
+
+def bedrock_request(region: str, action: str, payload: Dict) -> httpx.Request:
+    """Build a SigV4-signed request for a Bedrock runtime action in one region"""
+    url = f"{bedrock_endpoint(region)}/model/{quote(BEDROCK_MODEL_ID, safe='')}/{action}"
+    body = orjson.dumps(payload)
+
+    # Sign the request the same way boto3 would
+    from botocore.auth import SigV4Auth
+    from botocore.awsrequest import AWSRequest
+
+    aws_request = AWSRequest(
+        method="POST", url=url, data=body, headers={"Content-Type": "application/json"}
+    )
+    SigV4Auth(get_aws_credentials().get_frozen_credentials(), "bedrock", region).add_auth(aws_request)
+    return http_client.build_request("POST", url, headers=dict(aws_request.headers), content=body)
+
+
+async def converse(region: str, payload: Dict) -> Dict:
+    """Call the Bedrock Converse API in a single region"""
+    response = await http_client.send(bedrock_request(region, "converse", payload))
+    if response.status_code != 200:
+        raise await bedrock_error(response, "Converse")
+    return orjson.loads(response.content)
+
+
+async def open_converse_stream(region: str, payload: Dict) -> httpx.Response:
+    """Start a Bedrock ConverseStream call in a single region; the caller reads and closes it"""
+    response = await http_client.send(bedrock_request(region, "converse-stream", payload), stream=True)
+    if response.status_code != 200:
+        try:
+            raise await bedrock_error(response, "ConverseStream")
+        finally:
+            await response.aclose()
+    return response
+
+
+async def read_converse_stream(response: httpx.Response) -> AsyncIterator[str]:
+    """Yield the text deltas of an open ConverseStream response"""
+    from botocore.eventstream import EventStreamBuffer
+
+    events = EventStreamBuffer()
+    try:
+        async for chunk in response.aiter_bytes():
+            events.add_data(chunk)
+            for event in events:
+                headers = event.headers
+                if headers.get(":message-type") != "event":
+                    # Errors raised mid-stream, e.g. modelStreamErrorException
+                    code = headers.get(":exception-type") or headers.get(":error-code", "")
+                    raise aws_client_error(code, event.payload.decode(), "ConverseStream")
+                if headers.get(":event-type") == "contentBlockDelta":
+                    delta = orjson.loads(event.payload)["delta"]
+                    if "text" in delta:
+                        yield delta["text"]
+    finally:
+        await response.aclose()
+
+
+def cached_bedrock_history(session_id: str, conversation: List[Dict]) -> Optional[List[Dict]]:
+    """The Bedrock-formatted history cached alongside a conversation, if it is current"""
+    cached = _CONV_CACHE.get(session_id)
+    if cached is not None and cached[0] is conversation:
+        return cached[2]
+    return None
+
+
+def build_converse_payload(
+    conversation: List[Dict], user_message: str, history: Optional[List[Dict]] = None
+) -> Dict:
+    """Bedrock Converse request body for the next turn of a conversation.
+
+    history is the conversation already in Bedrock format (see cached_bedrock_history);
+    it is built from conversation when not given.
+    """
+    system = system_blocks()
     
-    # Build messages in Bedrock format
-    messages = []
+    # Compacted history is sent as a summary right after the system prompt
+    if conversation and conversation[0].get("compacted"):
+        system = system_blocks() + [{"text": f"Summary of the earlier conversation:\n{conversation[0]['content']}"}]
     
-    # Add system prompt as first user message (Bedrock convention)
-    messages.append({
-        "role": "user", 
-        "content": [{"text": f"System: {prompt()}"}]
-    })
+    if history is None:
+        history = bedrock_history(conversation)
     
-    # Add conversation history (limit to last 10 exchanges to manage context)
-    for msg in conversation[-20:]:  # Last 10 back-and-forth exchanges
-        messages.append({
-            "role": msg["role"],
-            "content": [{"text": msg["content"]}]
-        })
+    # Add conversation history; the window start moves in steps so the prefix stays byte-stable
+    start = max(0, len(history) - HISTORY_WINDOW)
+    start -= start % HISTORY_WINDOW_STEP
+    messages = history[start:]
     
-    # Add current user message
+    # Add current user message, led by the dynamic context. Only the current UTC hour is
+    # given, so it changes rarely, and it sits after the history so the cached prefix doesn't move
+    now = datetime.now(timezone.utc)
     messages.append({
         "role": "user",
-        "content": [{"text": user_message}]
+        "content": [
+            {"text": f"For reference, today is {now:%Y-%m-%d} and the time is {now:%H}:00-{now:%H}:59 UTC"},
+            {"text": user_message},
+        ]
     })
     
-    # Try each region with failover on throttling
+    # The system prompt goes in the dedicated system slot so it leads every request
+    return {
+        "system": system,
+        "messages": messages,
+        "inferenceConfig": {
+            "maxTokens": 2000,
+            "temperature": 0.7,
+            "topP": 0.9
+        }
+    }
+
+
+T = TypeVar("T")
+
+
+async def race_regions(
+    call: Callable[[str], Awaitable[T]],
+    discard: Optional[Callable[[T], Awaitable[None]]] = None,
+) -> T:
+    """Run call(region) with cross-region failover and return the first successful result.
+
+    The first BEDROCK_FANOUT regions are raced and whichever answers first wins; a
+    failing region doesn't stop the others in its batch. The next batch is only tried
+    if every region in the batch was throttled or denied access. Results from regions
+    that succeed but lose the race are passed to discard.
+    """
+    global current_region_index
+    
     last_error = None
-    regions_tried = 0
     
-    while regions_tried < len(BEDROCK_REGIONS):
-        region = BEDROCK_REGIONS[current_region_index]
-        client = bedrock_clients[region]
+    first = next(region_counter) % len(BEDROCK_REGIONS)
+    regions = tuple(itertools.islice(itertools.cycle(BEDROCK_REGIONS), first, first + len(BEDROCK_REGIONS)))
+    
+    for start in range(0, len(regions), BEDROCK_FANOUT):
+        batch = regions[start:start + BEDROCK_FANOUT]
+        print(f"Calling Bedrock in regions: {list(batch)}")
+        tasks = {asyncio.create_task(call(region)): region for region in batch}
+        pending = set(tasks)
+        winner = None
+        # Error to raise if no region in this batch answers
+        batch_error = None
         
         try:
-            print(f"Calling Bedrock in region: {region}")
-            
-            # Call Bedrock using the converse API
-            response = client.converse(
-                modelId=BEDROCK_MODEL_ID,
-                messages=messages,
-                inferenceConfig={
-                    "maxTokens": 2000,
-                    "temperature": 0.7,
-                    "topP": 0.9
-                }
-            )
-            
-            # Extract the response text
-            return response["output"]["message"]["content"][0]["text"]
-            
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            
-            if error_code == 'ThrottlingException':
-                # Throttled - try next region
-                print(f"Throttled in region {region}, trying next region...")
-                last_error = e
-                current_region_index = (current_region_index + 1) % len(BEDROCK_REGIONS)
-                regions_tried += 1
-                continue
-                
-            elif error_code == 'ValidationException':
-                # Handle message format issues - don't retry
-                print(f"Bedrock validation error: {e}")
-                raise HTTPException(status_code=400, detail="Invalid message format for Bedrock")
-                
-            elif error_code == 'AccessDeniedException':
-                print(f"Bedrock access denied in region {region}: {e}")
-                # Try next region in case access is regional
-                last_error = e
-                current_region_index = (current_region_index + 1) % len(BEDROCK_REGIONS)
-                regions_tried += 1
-                continue
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
                 
-            else:
-                print(f"Bedrock error in region {region}: {e}")
-                raise HTTPException(status_code=500, detail=f"Bedrock error: {str(e)}")
+                for task in done:
+                    region = tasks[task]
+                    
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error_code = aws_error_code(e)
+                        
+                        if error_code is None:
+                            # Network or client failure - let the rest of the batch answer
+                            print(f"Bedrock request failed in region {region}: {e}")
+                            last_error = e
+                            batch_error = batch_error or e
+                            continue
+                            
+                        elif error_code == 'ThrottlingException':
+                            # Throttled - wait for the rest of the batch
+                            print(f"Throttled in region {region}, trying next region...")
+                            last_error = e
+                            continue
+                            
+                        elif error_code == 'ValidationException':
+                            # Handle message format issues - don't retry
+                            print(f"Bedrock validation error: {e}")
+                            raise HTTPException(status_code=400, detail="Invalid message format for Bedrock")
+                            
+                        elif error_code == 'AccessDeniedException':
+                            print(f"Bedrock access denied in region {region}: {e}")
+                            # Try next region in case access is regional
+                            last_error = e
+                            continue
+                            
+                        else:
+                            print(f"Bedrock error in region {region}: {e}")
+                            last_error = e
+                            batch_error = batch_error or HTTPException(
+                                status_code=500, detail=f"Bedrock error: {str(e)}"
+                            )
+                            continue
+                    
+                    # Remember which region answered (reported by /health)
+                    current_region_index = BEDROCK_REGIONS.index(region)
+                    winner = task
+                    return result
+            
+            if batch_error is not None:
+                raise batch_error
+        finally:
+            # Drop the slower regions once we have an answer (or an error)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    if discard is not None:
+                        await discard(task.result())
     
     # All regions exhausted
     print(f"All {len(BEDROCK_REGIONS)} regions exhausted. Last error: {last_error}")
     raise HTTPException(
         status_code=429, 
-        detail=f"All Bedrock regions throttled. Please wait before trying again. Regions tried: {BEDROCK_REGIONS}"
+        detail=f"All Bedrock regions throttled. Please wait before trying again. Regions tried: {list(regions)}"
     )
 
 
+def reply_cache_key(payload: Dict) -> bytes:
+    """Key for a Bedrock request: system prompt, history window and user message all included"""
+    return hashlib.blake2b(orjson.dumps(payload), digest_size=16).digest()
+
+
+async def replay(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def read_and_cache(response: httpx.Response, key: bytes) -> AsyncIterator[str]:
+    """Pass a streamed reply through, caching the full text once it completes"""
+    parts = []
+    async for text in read_converse_stream(response):
+        parts.append(text)
+        yield text
+    reply_cache[key] = "".join(parts)
+
+
+async def call_bedrock(
+    conversation: List[Dict], user_message: str, history: Optional[List[Dict]] = None
+) -> str:
+    """Call AWS Bedrock with conversation history and cross-region failover"""
+    payload = build_converse_payload(conversation, user_message, history)
+    
+    # Identical request seen recently (e.g. a retry after a timeout)
+    key = reply_cache_key(payload)
+    cached = reply_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    response = await race_regions(lambda region: converse(region, payload))
+    
+    # Extract the response text
+    text = response["output"]["message"]["content"][0]["text"]
+    reply_cache[key] = text
+    return text
+
+
+async def stream_bedrock(
+    conversation: List[Dict], user_message: str, history: Optional[List[Dict]] = None
+) -> AsyncIterator[str]:
+    """Open a streamed Bedrock response (with cross-region failover) and return its text deltas.
+
+    Failover happens while opening the stream, so throttling and validation errors are
+    raised here, before anything has been sent to the client.
+    """
+    payload = build_converse_payload(conversation, user_message, history)
+    
+    # Identical request seen recently (e.g. a retry after a timeout)
+    key = reply_cache_key(payload)
+    cached = reply_cache.get(key)
+    if cached is not None:
+        return replay(cached)
+    
+    response = await race_regions(
+        lambda region: open_converse_stream(region, payload),
+        discard=lambda response: response.aclose(),
+    )
+    return read_and_cache(response, key)
+
+
 @app.get("/")
 async def root():
     return {
@@ -223,53 +781,123 @@ async def health_check():
     }
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def sse(event: str, data: Dict) -> bytes:
+    """Format one server-sent event"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def record_turn(session_id: str, conversation: List[Dict], user_message: str, assistant_response: str):
+    """Append a completed exchange to the conversation and save it"""
+    # One timestamp for the whole exchange
+    now = utc_timestamp()
+    turn = [
+        {"role": "user", "content": user_message, "timestamp": now},
+        {"role": "assistant", "content": assistant_response, "timestamp": now},
+    ]
+    conversation.extend(turn)
+    await save_conversation(session_id, conversation, turn)
+
+
+async def parse_chat_request(request: Request) -> ChatRequest:
+    """Decode and validate a chat request body"""
+    try:
+        return chat_request_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/chat")
+async def chat(raw_request: Request):
+    """Stream the reply as server-sent events: session, then delta events, then done (or error)"""
+    request = await parse_chat_request(raw_request)
     try:
         # Generate session ID if not provided
         session_id = request.session_id or str(uuid.uuid4())
 
         # Load conversation history
-        conversation = load_conversation(session_id)
-
-        # Call Bedrock for response
-        assistant_response = call_bedrock(conversation, request.message)
+        conversation = await load_conversation(session_id)
 
-        # Update conversation history
-        conversation.append(
-            {"role": "user", "content": request.message, "timestamp": datetime.now().isoformat()}
-        )
-        conversation.append(
-            {
-                "role": "assistant",
-                "content": assistant_response,
-                "timestamp": datetime.now().isoformat(),
-            }
+        # Start streaming from Bedrock
+        deltas = await stream_bedrock(
+            conversation, request.message, cached_bedrock_history(session_id, conversation)
         )
 
-        # Save conversation
-        save_conversation(session_id, conversation)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in chat endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield sse("session", {"session_id": session_id})
+        parts = []
+        try:
+            async for text in deltas:
+                parts.append(text)
+                yield sse("delta", {"text": text})
+
+            # Save conversation once the full reply is in
+            await record_turn(session_id, conversation, request.message, "".join(parts))
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            yield sse("error", {"detail": str(e)})
+            return
+        yield sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 
-        return ChatResponse(response=assistant_response, session_id=session_id)
+async def complete_chat(request: ChatRequest) -> ChatResponse:
+    """Run one non-streaming chat turn: load history, call Bedrock, save the exchange"""
+    # Generate session ID if not provided
+    session_id = request.session_id or str(uuid.uuid4())
 
+    # Load conversation history
+    conversation = await load_conversation(session_id)
+
+    # Call Bedrock for response
+    assistant_response = await call_bedrock(
+        conversation, request.message, cached_bedrock_history(session_id, conversation)
+    )
+
+    # Update and save conversation history
+    await record_turn(session_id, conversation, request.message, assistant_response)
+
+    return ChatResponse(response=assistant_response, session_id=session_id)
+
+
+@app.post("/chat/complete")
+async def chat_complete(raw_request: Request):
+    """Non-streaming chat: returns the whole reply in one JSON response"""
+    request = await parse_chat_request(raw_request)
+    try:
+        reply = await complete_chat(request)
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    return Response(content=msgspec.json.encode(reply), media_type="application/json")
+
 
 @app.get("/conversation/{session_id}")
 async def get_conversation(session_id: str):
     """Retrieve conversation history"""
     try:
-        conversation = load_conversation(session_id)
+        conversation = await load_conversation(session_id)
         return {"session_id": session_id, "messages": conversation}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+    )
\ No newline at end of file
@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import time
+
+import httpx
+import orjson
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+import server
+
+REGIONS = ("us-west-2", "us-east-1", "us-east-2")
+
+
+@pytest.fixture(autouse=True)
+def local_store(tmp_path, monkeypatch):
+    """Local file storage in a temp dir, fixed regions and empty caches for every test"""
+    monkeypatch.setattr(server, "USE_S3", False)
+    monkeypatch.setattr(server, "IS_LAMBDA", False)
+    monkeypatch.setattr(server, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "BEDROCK_REGIONS", REGIONS)
+    monkeypatch.setattr(server, "BEDROCK_FANOUT", 1)
+    monkeypatch.setattr(server, "region_counter", itertools.count())
+    monkeypatch.setattr(server, "system_blocks", lambda: [{"text": "system prompt"}])
+    server._CONV_CACHE.clear()
+    server._PENDING_SAVES.clear()
+    server._FAILED_SAVES.clear()
+    server.reply_cache.clear()
+    return tmp_path
+
+
+def reply(text):
+    return {"output": {"message": {"content": [{"text": text}]}}}
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "Converse")
+
+
+def turns(count, size=10):
+    """count alternating user/assistant messages"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}".ljust(size, "x")}
+        for i in range(count)
+    ]
+
+
+async def drain():
+    while server._PENDING_SAVES:
+        await asyncio.wait(list(server._PENDING_SAVES.values()))
+
+
+def read_log(session_id):
+    with open(server.get_log_path(session_id), "rb") as f:
+        return [orjson.loads(line) for line in f]
+
+
+# Region failover
+
+def test_throttled_region_fails_over_to_the_next(monkeypatch):
+    calls = []
+
+    async def converse(region, payload):
+        calls.append(region)
+        if region == REGIONS[0]:
+            raise client_error("ThrottlingException")
+        return reply(f"from {region}")
+
+    monkeypatch.setattr(server, "converse", converse)
+    assert asyncio.run(server.call_bedrock([], "hi")) == f"from {REGIONS[1]}"
+    assert calls == list(REGIONS[:2])
+
+
+def test_start_region_rotates_per_request(monkeypatch):
+    calls = []
+
+    async def converse(region, payload):
+        calls.append(region)
+        return reply("ok")
+
+    monkeypatch.setattr(server, "converse", converse)
+    for i in range(len(REGIONS)):
+        asyncio.run(server.call_bedrock([], f"hi {i}"))
+    assert calls == list(REGIONS)
+
+
+def test_all_regions_throttled_is_a_429(monkeypatch):
+    calls = []
+
+    async def converse(region, payload):
+        calls.append(region)
+        raise client_error("ThrottlingException")
+
+    monkeypatch.setattr(server, "converse", converse)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.call_bedrock([], "hi"))
+    assert e.value.status_code == 429
+    assert calls == list(REGIONS)
+
+
+def test_failing_region_doesnt_stop_the_race(monkeypatch):
+    monkeypatch.setattr(server, "BEDROCK_FANOUT", 2)
+
+    async def converse(region, payload):
+        if region == REGIONS[0]:
+            raise httpx.ConnectError("connection refused")
+        await asyncio.sleep(0.01)
+        return reply(f"from {region}")
+
+    monkeypatch.setattr(server, "converse", converse)
+    assert asyncio.run(server.call_bedrock([], "hi")) == f"from {REGIONS[1]}"
+
+
+def test_failed_batch_raises_the_region_error(monkeypatch):
+    monkeypatch.setattr(server, "BEDROCK_FANOUT", 2)
+
+    async def converse(region, payload):
+        raise client_error("ModelNotReadyException")
+
+    monkeypatch.setattr(server, "converse", converse)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.call_bedrock([], "hi"))
+    assert e.value.status_code == 500
+
+
+def test_validation_error_stops_the_race(monkeypatch):
+    monkeypatch.setattr(server, "BEDROCK_FANOUT", 2)
+
+    async def converse(region, payload):
+        if region == REGIONS[0]:
+            raise client_error("ValidationException")
+        await asyncio.sleep(0.01)
+        return reply("too late")
+
+    monkeypatch.setattr(server, "converse", converse)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(server.call_bedrock([], "hi"))
+    assert e.value.status_code == 400
+
+
+def test_losing_results_are_discarded(monkeypatch):
+    monkeypatch.setattr(server, "BEDROCK_FANOUT", 2)
+    discarded = []
+
+    async def call(region):
+        return region
+
+    async def discard(result):
+        discarded.append(result)
+
+    winner = asyncio.run(server.race_regions(call, discard))
+    assert discarded == [r for r in REGIONS[:2] if r != winner]
+
+
+# Saving
+
+def test_background_saves_land_in_order(monkeypatch):
+    write = server.write_conversation
+
+    def slow_write(*args):
+        time.sleep(0.01)
+        return write(*args)
+
+    monkeypatch.setattr(server, "write_conversation", slow_write)
+
+    async def run():
+        for i in range(5):
+            conversation = await server.load_conversation("s")
+            await server.record_turn("s", conversation, f"u{i}", f"a{i}")
+        await drain()
+
+    asyncio.run(run())
+    expected = [text for i in range(5) for text in (f"u{i}", f"a{i}")]
+    assert [m["content"] for m in read_log("s")] == expected
+
+
+def test_failed_save_is_rewritten_by_the_next(monkeypatch):
+    write = server.write_conversation
+    attempts = []
+
+    def flaky_write(*args):
+        # The first turn creates the log; appending the second one fails
+        attempts.append(args)
+        if len(attempts) == 2:
+            raise OSError("disk full")
+        return write(*args)
+
+    monkeypatch.setattr(server, "write_conversation", flaky_write)
+
+    async def run():
+        for i in range(3):
+            conversation = await server.load_conversation("s")
+            await server.record_turn("s", conversation, f"u{i}", f"a{i}")
+            await drain()
+
+    asyncio.run(run())
+    assert [m["content"] for m in read_log("s")] == ["u0", "a0", "u1", "a1", "u2", "a2"]
+    assert not server._FAILED_SAVES
+
+
+def test_shutdown_waits_for_pending_saves(monkeypatch):
+    write = server.write_conversation
+
+    def slow_write(*args):
+        time.sleep(0.05)
+        return write(*args)
+
+    async def no_warm_up():
+        pass
+
+    monkeypatch.setattr(server, "write_conversation", slow_write)
+    monkeypatch.setattr(server, "warm_up_bedrock", no_warm_up)
+
+    async def run():
+        async with server.lifespan(server.app):
+            conversation = await server.load_conversation("s")
+            await server.record_turn("s", conversation, "u0", "a0")
+
+    asyncio.run(run())
+    assert [m["content"] for m in read_log("s")] == ["u0", "a0"]
+
+
+def test_torn_log_tail_is_dropped(local_store):
+    log = b"".join(orjson.dumps(m, option=orjson.OPT_APPEND_NEWLINE) for m in turns(2))
+    with open(server.get_log_path("s"), "wb") as f:
+        f.write(log + b'{"role":"user","content":"u1"}\n{"role":"assis')
+
+    messages, _ = server.read_conversation("s")
+    assert messages == turns(2)
+    with open(server.get_log_path("s"), "rb") as f:
+        assert f.read() == log
+
+
+# Compaction
+
+def test_compaction_ignores_the_kept_tail():
+    # The last HISTORY_KEEP messages alone are over the budget, but compaction can't shrink them
+    messages = turns(server.HISTORY_KEEP + 2, size=2000)
+    assert not server.needs_compaction(messages)
+
+
+def test_compaction_triggers():
+    assert not server.needs_compaction(turns(server.HISTORY_KEEP + 1, size=100_000))
+    assert server.needs_compaction(turns(server.HISTORY_COMPACT_AT + 2))
+    assert server.needs_compaction(turns(2, size=40_000) + turns(server.HISTORY_KEEP))
+
+
+def test_compaction_swaps_the_summary_in_place(monkeypatch):
+    monkeypatch.setattr(server, "HISTORY_COMPACT_AT", 6)
+    monkeypatch.setattr(server, "HISTORY_KEEP", 4)
+
+    async def run():
+        summarizing = asyncio.Event()
+
+        async def summarize(conversation, user_message, history=None):
+            await summarizing.wait()
+            return "summary"
+
+        monkeypatch.setattr(server, "call_bedrock", summarize)
+        for i in range(4):
+            conversation = await server.load_conversation("s")
+            await server.record_turn("s", conversation, f"u{i}", f"a{i}")
+        await asyncio.sleep(0.01)
+
+        # A turn recorded on the live history while the summary is being written must
+        # survive the swap (loading would wait for the pending save)
+        await server.record_turn("s", conversation, "u4", "a4")
+        summarizing.set()
+        await drain()
+        return await server.load_conversation("s")
+
+    live = asyncio.run(run())
+    assert live[0]["compacted"] and live[0]["content"] == "summary"
+    assert [m["content"] for m in live[1:]] == ["u2", "a2", "u3", "a3", "u4", "a4"]
+    assert server._CONV_CACHE["s"][2] == server.bedrock_history(live)
+
+
+# Converse payload
+
+def test_history_window_start_moves_in_steps():
+    window, step = server.HISTORY_WINDOW, server.HISTORY_WINDOW_STEP
+    previous_start = 0
+    for count in range(0, 80, 2):
+        history = turns(count)
+        payload = server.build_converse_payload(history, "next")
+        sent = payload["messages"][:-1]
+        start = count - len(sent)
+
+        assert start % step == 0
+        assert start >= previous_start
+        assert min(count, window) <= len(sent) < window + step
+        assert sent == server.bedrock_history(history)[start:]
+        previous_start = start
+
+
+def test_payload_layout():
+    conversation = [{"role": "assistant", "content": "earlier", "compacted": True}] + turns(2)
+    payload = server.build_converse_payload(conversation, "next")
+
+    assert payload["system"] == [
+        {"text": "system prompt"},
+        {"text": "Summary of the earlier conversation:\nearlier"},
+    ]
+    assert payload["messages"][:-1] == server.bedrock_history(turns(2))
+    dynamic, user = payload["messages"][-1]["content"]
+    assert dynamic["text"].startswith("For reference") and dynamic["text"].endswith("UTC")
+    assert user == {"text": "next"}
@@ -52,22 +52,52 @@ export default function Twin() {
                 }),
             });
 
-            if (!response.ok) throw new Error('Failed to send message');
+            if (!response.ok || !response.body) throw new Error('Failed to send message');
 
-            const data = await response.json();
+            // The reply streams back as server-sent events:
+            // session, then delta events with text, then done (or error)
+            const assistantId = (Date.now() + 1).toString();
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let started = false;
 
-            if (!sessionId) {
-                setSessionId(data.session_id);
-            }
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
 
-            const assistantMessage: Message = {
-                id: (Date.now() + 1).toString(),
-                role: 'assistant',
-                content: data.response,
-                timestamp: new Date(),
-            };
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop() ?? '';
+
+                for (const raw of events) {
+                    const event = raw.match(/^event: (.*)$/m)?.[1];
+                    const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? '{}');
 
-            setMessages(prev => [...prev, assistantMessage]);
+                    if (event === 'session') {
+                        if (!sessionId) {
+                            setSessionId(data.session_id);
+                        }
+                    } else if (event === 'delta') {
+                        if (!started) {
+                            started = true;
+                            const assistantMessage: Message = {
+                                id: assistantId,
+                                role: 'assistant',
+                                content: data.text,
+                                timestamp: new Date(),
+                            };
+                            setMessages(prev => [...prev, assistantMessage]);
+                        } else {
+                            setMessages(prev =>
+                                prev.map(m => (m.id === assistantId ? { ...m, content: m.content + data.text } : m))
+                            );
+                        }
+                    } else if (event === 'error') {
+                        throw new Error(data.detail);
+                    }
+                }
+            }
         } catch (error) {
             console.error('Error:', error);
             const errorMessage: Message = {
@@ -181,7 +211,7 @@ export default function Twin() {
                     </div>
                 ))}
 
-                {isLoading && (
+                {isLoading && messages[messages.length - 1]?.role === 'user' && (
                     <div className="flex gap-3 justify-start">
                         <div className="flex-shrink-0">
                             {hasAvatar ? (
@@ -176,6 +176,9 @@ resource "aws_apigatewayv2_integration" "lambda" {
   api_id           = aws_apigatewayv2_api.main.id
   integration_type = "AWS_PROXY"
   integration_uri  = aws_lambda_function.api.invoke_arn
+
+  # lambda_handler.py dispatches on the 2.0 event fields (rawPath, requestContext.http)
+  payload_format_version = "2.0"
 }
 
 # API Gateway Routes
@@ -191,6 +194,12 @@ resource "aws_apigatewayv2_route" "post_chat" {
   target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
 }
 
+resource "aws_apigatewayv2_route" "post_chat_complete" {
+  api_id    = aws_apigatewayv2_api.main.id
+  route_key = "POST /chat/complete"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+}
+
 resource "aws_apigatewayv2_route" "get_health" {
   api_id    = aws_apigatewayv2_api.main.id
   route_key = "GET /health"